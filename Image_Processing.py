@@ -1,5 +1,106 @@
+import os
+import textwrap
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
-from PIL import Image
+from PIL import Image, ImageFilter
+from scipy import ndimage as ndi
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_TILE = 64
+_BLOCK_BYTES = 1 << 18
+_GPU_MIN_PIXELS = 2000000
+
+if numba is not None:
+    @numba.njit(parallel=True, cache=True, fastmath=True)
+    def _convolve(plane, kernel, out):
+        height, width = out.shape
+        kh, kw = kernel.shape
+        ph, pw = kh // 2, kw // 2
+        tiles_x = (width + _TILE - 1) // _TILE
+        tiles = (height + _TILE - 1) // _TILE * tiles_x
+        for t in numba.prange(tiles):
+            ii = t // tiles_x * _TILE
+            jj = t % tiles_x * _TILE
+            for i in range(ii, min(ii + _TILE, height)):
+                for j in range(jj, min(jj + _TILE, width)):
+                    acc = np.float32(0.0)
+                    for a in range(kh):
+                        y = min(max(i + a - ph, 0), height - 1)
+                        for b in range(kw):
+                            x = min(max(j + b - pw, 0), width - 1)
+                            acc += plane[y, x] * kernel[a, b]
+                    out[i, j] = min(max(acc, np.float32(0.0)), np.float32(255.0))
+
+    @numba.njit(cache=True)
+    def _grayscale_pixels(src, dst):
+        for i in range(src.shape[0]):
+            for j in range(src.shape[1]):
+                gray = (src[i, j, 0] * 19595 + src[i, j, 1] * 38470 + src[i, j, 2] * 7471 + 0x8000) >> 16
+                dst[i, j, 0] = gray
+                dst[i, j, 1] = gray
+                dst[i, j, 2] = gray
+
+_SPECIALIZED = {}
+_SPECIALIZED_SOURCE = """
+    def convolve(plane, kernel, out):
+        height, width = out.shape
+        for i in numba.prange(height):
+            y0, y1, y2 = max(i - 1, 0), i, min(i + 1, height - 1)
+            for j in range(width):
+                x0, x1, x2 = max(j - 1, 0), j, min(j + 1, width - 1)
+                out[i, j] = min(max({taps}, np.float32(0.0)), np.float32(255.0))
+"""
+
+def _specialize(kernel):
+    key = kernel.tobytes()
+    if key not in _SPECIALIZED:
+        taps = " + ".join(
+            f"plane[y{a}, x{b}] * np.float32({float(k)!r})"
+            for (a, b), k in np.ndenumerate(kernel) if k != 0
+        )
+        namespace = {"np": np, "numba": numba}
+        exec(textwrap.dedent(_SPECIALIZED_SOURCE).format(taps=taps or "np.float32(0.0)"), namespace)
+        _SPECIALIZED[key] = numba.njit(parallel=True, fastmath=True)(namespace["convolve"])
+    return _SPECIALIZED[key]
+
+def _separate_kernel(kernel):
+    u, s, vt = np.linalg.svd(kernel)
+    if s[0] == 0 or not np.allclose(s[1:], 0, atol=s[0] * 1e-6):
+        return None
+    scale = np.sqrt(s[0])
+    return vt[0] * scale, u[:, 0] * scale
+
+def _correlate_rows(plane, kernel, separable, out, top, bottom):
+    kh = kernel.shape[0]
+    lo, hi = max(top - kh // 2, 0), min(bottom + (kh - 1) // 2, plane.shape[0])
+    if separable is not None:
+        kx, ky = separable
+        rows = ndi.correlate1d(plane[lo:hi], kx, axis=1, output=np.float32, mode='nearest')
+        ndi.correlate1d(rows, ky, axis=0, output=rows, mode='nearest')
+    else:
+        rows = ndi.correlate(plane[lo:hi], kernel, output=np.float32, mode='nearest')
+    np.clip(rows, 0, 255, out=rows)
+    out[top:bottom] = rows[top - lo:bottom - lo]
+
+def _as_pil(arr):
+    return Image.fromarray(arr.astype(np.uint8, copy=False))
+
+def _invert(src, dst):
+    np.bitwise_xor(src, np.uint8(255), out=dst)
+
+def _grayscale(src, dst):
+    if numba is not None:
+        _grayscale_pixels(src, dst)
+    else:
+        gray = np.asarray(_as_pil(src).convert("L"))
+        dst[...] = gray[..., None]
 
 class NaryTreeNode:
     def __init__(self, name):
@@ -12,32 +113,47 @@ class NaryTreeNode:
 class NaryTree:
     def __init__(self):
         self.root = NaryTreeNode("Filters")
+        self._nodes = {self.root.name: self.root}
 
     def add_filter(self, parent_name, filter_name):
-        parent_node = self._find_node(self.root, parent_name)
+        parent_node = self._nodes.get(parent_name)
         if parent_node:
-            parent_node.add_child(NaryTreeNode(filter_name))
-
-    def _find_node(self, node, name):
-        if node.name == name:
-            return node
-        for child in node.children:
-            found = self._find_node(child, name)
-            if found:
-                return found
-        return None
+            node = NaryTreeNode(filter_name)
+            parent_node.add_child(node)
+            self._nodes[filter_name] = node
 
-class FilterHistory:
-    def __init__(self):
-        self.history = []
+class FilterOp:
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
 
-    def push(self, image):
-        self.history.append(np.copy(image))
+    def __call__(self, src, dst):
+        self.func(src, dst)
 
-    def pop(self):
-        if self.history:
-            return self.history.pop()
-        return None
+class FilterHistory:
+    inverses = {"inversion": np.invert}
+
+    def __init__(self, max_depth=8):
+        self.history = deque(maxlen=max_depth)
+
+    def push(self, image, replay=()):
+        shape = (image.height, image.width, 3) if isinstance(image, Image.Image) else image.shape
+        self.history.append(("snapshot", (shape, tuple(replay)), zlib.compress(image.tobytes(), 1)))
+
+    def push_op(self, name, *params):
+        self.history.append(("op", name, params))
+
+    def pop(self, current):
+        if not self.history:
+            return None
+        kind, key, data = self.history.pop()
+        if kind == "op":
+            return self.inverses[key](current(), *data)
+        shape, replay = key
+        image = np.frombuffer(bytearray(zlib.decompress(data)), dtype=np.uint8).reshape(shape)
+        for op in replay:
+            op(image, image)
+        return image
 
 class FilterRegistry:
     def __init__(self):
@@ -50,12 +166,20 @@ class FilterRegistry:
         return self.filters.get(name)
 
 class ImageProcessor:
-    def __init__(self, image_path):
+    def __init__(self, image_path, use_gpu=False):
         self.image = Image.open(image_path).convert("RGB")
-        self.image_array = np.array(self.image)
+        self._pil = self.image
+        self._array = None
         self.history = FilterHistory()
         self.registry = FilterRegistry()
         self.tree = NaryTree()
+        shape = (self.image.height, self.image.width, 3)
+        self._buffers = [np.empty(shape, dtype=np.uint8), np.empty(shape, dtype=np.uint8)]
+        self._workers = os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(max_workers=self._workers)
+        self._pending = []
+        self._gpu = self._load_gpu() if use_gpu else None
+        self._device = None
         self._register_filters()
         self._build_tree()
 
@@ -76,22 +200,117 @@ class ImageProcessor:
         self.tree.add_filter("Transformations", "Crop")
         self.tree.add_filter("Transformations", "Rotate")
 
-    def apply_filter(self, kernel):
-        kh, kw = kernel.shape
-        ph, pw = kh // 2, kw // 2
+    @property
+    def image_array(self):
+        if self._array is None:
+            self._array = np.asarray(self._pil)
+        return self._array
+
+    @image_array.setter
+    def image_array(self, value):
+        self._array = value
+        self._pil = None
+
+    def _current_image(self):
+        if self._pil is None:
+            self._pil = _as_pil(self._array)
+        return self._pil
+
+    def _set_image(self, image):
+        self._pil = image
+        self._array = None
+
+    def _push_snapshot(self):
+        self.history.push(self._array if self._array is not None else self._pil)
+
+    def _back_buffer(self, shape=None):
+        shape = self.image_array.shape if shape is None else shape
+        for i, buf in enumerate(self._buffers):
+            if np.may_share_memory(buf, self.image_array):
+                continue
+            if buf.shape != shape:
+                buf = self._buffers[i] = np.empty(shape, dtype=np.uint8)
+            return buf
+
+    def flush(self):
+        if not self._pending:
+            return
+        ops, self._pending = self._pending, []
+        source = self.image_array
+        for k, op in enumerate(ops):
+            if op.name in self.history.inverses:
+                self.history.push_op(op.name)
+            else:
+                self.history.push(source, replay=ops[:k])
+
+        result = self._back_buffer()
+        rows = max(1, _BLOCK_BYTES // (source.shape[1] * 3))
+        for top in range(0, source.shape[0], rows):
+            src, dst = source[top:top + rows], result[top:top + rows]
+            for op in ops:
+                op(src, dst)
+                src = dst
+        self.image_array = result
 
-        padded = np.pad(self.image_array, ((ph, ph), (pw, pw), (0, 0)), mode='edge')
-        filtered = np.zeros_like(self.image_array)
+    def _load_gpu(self):
+        try:
+            import cupy
+            from cupyx.scipy import ndimage as cupy_ndi
+        except ImportError:
+            print("CuPy is not installed; filtering on the CPU.")
+            return None
+        return cupy, cupy_ndi
+
+    def _correlate_cpu(self, kernel, separable):
+        planes = np.ascontiguousarray(np.moveaxis(self.image_array, -1, 0))
+        result = self._back_buffer()
+        channels = np.moveaxis(result, -1, 0)
+        if separable is None and numba is not None:
+            convolve = _specialize(kernel) if kernel.shape == (3, 3) else _convolve
+            for plane, out in zip(planes, channels):
+                convolve(plane, kernel, out)
+        else:
+            height = planes.shape[1]
+            stripes = max(1, min(-(-self._workers // len(planes)), height // 256))
+            step = -(-height // stripes)
+            tasks = [
+                self._pool.submit(_correlate_rows, plane, kernel, separable, out, top, min(top + step, height))
+                for plane, out in zip(planes, channels)
+                for top in range(0, height, step)
+            ]
+            for task in tasks:
+                task.result()
+        return result
+
+    def _correlate_gpu(self, kernel, separable):
+        cupy, cupy_ndi = self._gpu
+        if self._device is None or self._device[0] is not self.image_array:
+            self._device = (self.image_array, cupy.asarray(self.image_array))
+        image = self._device[1]
+        if separable is not None:
+            kx, ky = (cupy.asarray(k) for k in separable)
+            filtered = cupy_ndi.correlate1d(image, kx, axis=1, output=cupy.float32, mode='nearest')
+            filtered = cupy_ndi.correlate1d(filtered, ky, axis=0, mode='nearest')
+        else:
+            filtered = cupy_ndi.correlate(image, cupy.asarray(kernel)[:, :, None], output=cupy.float32, mode='nearest')
+        device_result = cupy.clip(filtered, 0, 255, out=filtered).astype(cupy.uint8)
+        result = cupy.asnumpy(device_result)
+        self._device = (result, device_result)
+        return result
 
-        for i in range(self.image_array.shape[0]):
-            for j in range(self.image_array.shape[1]):
-                region = padded[i:i+kh, j:j+kw]
-                pixel = np.sum(region * kernel[:, :, None], axis=(0, 1))
-                filtered[i, j] = pixel
+    def apply_filter(self, kernel):
+        self.flush()
+        kernel = np.asarray(kernel, dtype=np.float32)
+        separable = _separate_kernel(kernel)
+        height, width = self.image_array.shape[:2]
+        if self._gpu is not None and height * width >= _GPU_MIN_PIXELS:
+            result = self._correlate_gpu(kernel, separable)
+        else:
+            result = self._correlate_cpu(kernel, separable)
 
-        self.history.push(self.image_array)
-        self.image_array = filtered
-        return Image.fromarray(filtered.astype('uint8'))
+        self._push_snapshot()
+        self.image_array = result
+        return _as_pil(result)
 
     def display_filters(self):
         print("\nAvailable Filters:")
@@ -101,50 +320,57 @@ class ImageProcessor:
                 print(f"   {i}.{j} {sub.name}")
 
     def apply_inversion(self):
-        result = 255 - self.image_array
-        self.history.push(self.image_array)
-        self.image_array = result
-        return Image.fromarray(result.astype('uint8'))
+        op = FilterOp("inversion", _invert)
+        self._pending.append(op)
+        return op
 
     def apply_grayscale(self):
-        gray = np.dot(self.image_array[..., :3], [0.2989, 0.5870, 0.1140])
-        result = np.stack((gray,)*3, axis=-1)
-        self.history.push(self.image_array)
-        self.image_array = result
-        return Image.fromarray(result.astype('uint8'))
+        op = FilterOp("grayscale", _grayscale)
+        self._pending.append(op)
+        return op
 
     def apply_blur(self):
-        kernel = np.ones((3, 3)) / 9
-        return self.apply_filter(kernel)
+        self.flush()
+        result = self._current_image().filter(ImageFilter.BoxBlur(1))
+        self._push_snapshot()
+        self._set_image(result)
+        return result
 
     def apply_crop(self):
+        self.flush()
         left = int(input("Left: "))
         top = int(input("Top: "))
         right = int(input("Right: "))
         bottom = int(input("Bottom: "))
 
-        if left < 0 or top < 0 or right > self.image_array.shape[1] or bottom > self.image_array.shape[0]:
+        image = self._current_image()
+        if left < 0 or top < 0 or right > image.width or bottom > image.height:
             print("Invalid coordinates.")
-            return Image.fromarray(self.image_array.astype('uint8'))
+            return image
 
         if left >= right or top >= bottom:
             print("Invalid rectangle.")
-            return Image.fromarray(self.image_array.astype('uint8'))
+            return image
 
-        result = self.image_array[top:bottom, left:right]
-        self.history.push(self.image_array)
-        self.image_array = result
-        return Image.fromarray(result.astype('uint8'))
+        result = image.crop((left, top, right, bottom))
+        self._push_snapshot()
+        self._set_image(result)
+        return result
 
     def apply_rotate(self):
+        self.flush()
         angle = float(input("Angle: "))
-        rotated = Image.fromarray(self.image_array).rotate(angle)
-        self.history.push(self.image_array)
-        self.image_array = np.array(rotated)
+        rotated = self._current_image().rotate(angle)
+        self._push_snapshot()
+        self._set_image(rotated)
         return rotated
 
     def undo(self):
-        prev = self.history.pop()
+        if self._pending:
+            self._pending.pop()
+            print("Undo successful.")
+            return
+        prev = self.history.pop(lambda: self.image_array)
         if prev is not None:
             self.image_array = prev
             print("Undo successful.")
@@ -152,7 +378,8 @@ class ImageProcessor:
             print("Nothing to undo.")
 
     def show_image(self):
-        Image.fromarray(self.image_array.astype('uint8')).show()
+        self.flush()
+        self._current_image().show()
 
 def main():
     path = input("Enter image path: ")